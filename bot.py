@@ -1,20 +1,28 @@
+import time
+
+# Засекаем время холодного старта до тяжелых импортов
+START_TIME = time.perf_counter()
+
 import asyncio
 import logging
 import sys
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Any, Awaitable, Callable, Dict, List
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, Router, BaseMiddleware, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.filters import Command, CommandObject
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Update
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 
 import pytz
-from config import BOT_TOKEN, ADMIN_IDS, MOSCOW_TZ
-from database import db  # Импортируем глобальный экземпляр
+from config import MOSCOW_TZ, SHUTDOWN_TIMEOUT, load_tenants
+from database import Database
+from recurrence import parse_rule, describe_rule
+from storage import SQLiteStorage
+from middlewares import InFlightMiddleware
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,10 +35,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Подставляет в обработчики базу и администраторов команды, которой принадлежит бот
+class TenantMiddleware(BaseMiddleware):
+    def __init__(self, tenants: Dict[int, Dict]):
+        self.tenants = tenants
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        tenant = self.tenants[data['bot'].id]
+        data['tenant'] = tenant
+        data['db'] = tenant['db']
+        data['admin_ids'] = tenant['admin_ids']
+        return await handler(event, data)
+
+# Обработчики общие для всех ботов. Боты и диспетчер создаются в main(), а не при импорте
+router = Router()
+
+# Сигнал остановки для фоновых задач
+shutdown_event = asyncio.Event()
 
 # Часовой пояс Москвы
 moscow_tz = pytz.timezone(MOSCOW_TZ)
@@ -40,8 +66,8 @@ class TaskStates(StatesGroup):
     waiting_for_task_selection = State()
     waiting_for_comment = State()
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
+def is_admin(user_id: int, admin_ids: List[int]) -> bool:
+    return user_id in admin_ids
 
 def format_task(task: Dict) -> str:
     """Форматирует задачу в читаемый вид"""
@@ -53,6 +79,8 @@ def format_task(task: Dict) -> str:
     text += f"👤 Исполнитель: {task['assignee_username']}\n"
     text += f"⏰ Дедлайн: {task['deadline'].strftime('%d.%m.%Y %H:%M')}\n"
     text += f"📊 Статус: {status_text}\n"
+    if task.get('series_id'):
+        text += f"🔁 Повторяющаяся задача (серия #{task['series_id']})\n"
     text += f"📅 Дата создания: {task['created_at'].strftime('%d.%m.%Y %H:%M')}\n"
     
     if task['completed_at']:
@@ -63,8 +91,8 @@ def format_task(task: Dict) -> str:
     return text
 
 # Команда /start
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
+@router.message(Command("start"))
+async def cmd_start(message: Message, db: Database, admin_ids: List[int]):
     user_id = message.from_user.id
     username = message.from_user.username or ""
     first_name = message.from_user.first_name or ""
@@ -78,23 +106,27 @@ async def cmd_start(message: Message):
     welcome_text += "📋 Основные команды:\n"
     welcome_text += "/tasks - показать мои задачи\n\n"
     
-    if is_admin(user_id):
+    if is_admin(user_id, admin_ids):
         welcome_text += "⚡ Команды администратора:\n"
         welcome_text += "/create_task - создать задачу\n"
+        welcome_text += "/create_recurring - создать повторяющуюся задачу\n"
         welcome_text += "/all_tasks - все задачи\n"
         welcome_text += "/delete_task - удалить задачу\n"
         welcome_text += "/users - список пользователей\n\n"
         welcome_text += "📝 Формат создания задачи:\n"
         welcome_text += "/create_task @username DD.MM.YYYY HH:MM Описание задачи\n\n"
+        welcome_text += "🔁 Формат повторяющейся задачи:\n"
+        welcome_text += "/create_recurring @username daily|mon..sun|month:N HH:MM Описание задачи\n\n"
         welcome_text += "❌ Формат удаления задачи:\n"
-        welcome_text += "/delete_task id_задачи"
+        welcome_text += "/delete_task id_задачи\n"
+        welcome_text += "(удаление невыполненной задачи серии останавливает всю серию)"
     
     await message.answer(welcome_text)
     logger.info(f"✅ Пользователь {user_id} получил приветствие")
 
 # Команда /tasks
-@dp.message(Command("tasks"))
-async def cmd_tasks(message: Message):
+@router.message(Command("tasks"))
+async def cmd_tasks(message: Message, db: Database):
     user_id = message.from_user.id
     logger.info(f"📋 Пользователь {user_id} запросил задачи")
     
@@ -122,8 +154,8 @@ async def cmd_tasks(message: Message):
     logger.info(f"✅ Пользователь {user_id} получил {len(tasks)} задач")
 
 # Обработка кнопки "Выполнить задачу"
-@dp.callback_query(F.data == "complete_task")
-async def complete_task_callback(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data == "complete_task")
+async def complete_task_callback(callback: CallbackQuery, state: FSMContext, db: Database):
     user_id = callback.from_user.id
     logger.info(f"🔄 Пользователь {user_id} начал выполнение задачи")
     
@@ -152,7 +184,7 @@ async def complete_task_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Выбор задачи для выполнения
-@dp.callback_query(TaskStates.waiting_for_task_selection, F.data.startswith("select_task_"))
+@router.callback_query(TaskStates.waiting_for_task_selection, F.data.startswith("select_task_"))
 async def select_task_callback(callback: CallbackQuery, state: FSMContext):
     task_id = int(callback.data.split("_")[2])
     logger.info(f"🎯 Пользователь {callback.from_user.id} выбрал задачу #{task_id}")
@@ -163,8 +195,8 @@ async def select_task_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Получение комментария и завершение задачи
-@dp.message(TaskStates.waiting_for_comment)
-async def process_comment(message: Message, state: FSMContext):
+@router.message(TaskStates.waiting_for_comment)
+async def process_comment(message: Message, state: FSMContext, db: Database):
     data = await state.get_data()
     task_id = data['selected_task_id']
     comment = message.text
@@ -182,13 +214,36 @@ async def process_comment(message: Message, state: FSMContext):
     )
     await state.clear()
 
+async def notify_assignee(message: Message, db: Database, username: str, notification_text: str):
+    """Отправляет уведомление исполнителю, если он зарегистрирован в боте"""
+    try:
+        # Находим пользователя по username
+        users = db.get_all_users()
+        assignee_user_id = None
+        
+        for user in users:
+            user_id, user_username, first_name, last_name, registered_at = user
+            # Сравниваем username без @
+            if user_username and user_username.lower() == username.lstrip('@').lower():
+                assignee_user_id = user_id
+                break
+        
+        if assignee_user_id:
+            await message.bot.send_message(assignee_user_id, notification_text)
+            logger.info(f"✅ Уведомление отправлено исполнителю {username} (ID: {assignee_user_id})")
+        else:
+            logger.warning(f"⚠️ Исполнитель {username} не найден в базе пользователей")
+            
+    except Exception as e:
+        logger.error(f"❌ Ошибка при отправке уведомления исполнителю {username}: {e}")
+
 # Команда /create_task (только для администраторов)
-@dp.message(Command("create_task"))
-async def cmd_create_task(message: Message, command: CommandObject):
+@router.message(Command("create_task"))
+async def cmd_create_task(message: Message, command: CommandObject, db: Database, admin_ids: List[int]):
     user_id = message.from_user.id
     logger.info(f"📝 Админ {user_id} создает задачу: {command.args}")
     
-    if not is_admin(user_id):
+    if not is_admin(user_id, admin_ids):
         await message.answer("❌ У вас нет прав для выполнения этой команды")
         return
     
@@ -237,43 +292,85 @@ async def cmd_create_task(message: Message, command: CommandObject):
         logger.info(f"✅ Задача #{task_id} создана для {username}")
         
         # УВЕДОМЛЕНИЕ ИСПОЛНИТЕЛЮ
-        try:
-            # Находим пользователя по username
-            users = db.get_all_users()
-            assignee_user_id = None
-            
-            for user in users:
-                user_id, user_username, first_name, last_name, registered_at = user
-                # Сравниваем username без @
-                if user_username and user_username.lower() == username.lstrip('@').lower():
-                    assignee_user_id = user_id
-                    break
-            
-            if assignee_user_id:
-                notification_text = (
-                    f"📋 Вам назначена новая задача!\n\n"
-                    f"🆔 ID задачи: {task_id}\n"
-                    f"📝 Описание: {description}\n"
-                    f"⏰ Дедлайн: {deadline.strftime('%d.%m.%Y %H:%M')}\n"
-                    f"📊 Статус: To do\n\n"
-                    f"Для просмотра задач используйте команду /tasks"
-                )
-                
-                await bot.send_message(assignee_user_id, notification_text)
-                logger.info(f"✅ Уведомление отправлено исполнителю {username} (ID: {assignee_user_id})")
-            else:
-                logger.warning(f"⚠️ Исполнитель {username} не найден в базе пользователей")
-                
-        except Exception as e:
-            logger.error(f"❌ Ошибка при отправке уведомления исполнителю {username}: {e}")
+        await notify_assignee(
+            message, db, username,
+            f"📋 Вам назначена новая задача!\n\n"
+            f"🆔 ID задачи: {task_id}\n"
+            f"📝 Описание: {description}\n"
+            f"⏰ Дедлайн: {deadline.strftime('%d.%m.%Y %H:%M')}\n"
+            f"📊 Статус: To do\n\n"
+            f"Для просмотра задач используйте команду /tasks"
+        )
         
     except ValueError as e:
         await message.answer(f"❌ Ошибка формата: {e}\n\nПравильный формат:\n/create_task @username DD.MM.YYYY HH:MM Описание задачи")
 
+# Команда /create_recurring (только для администраторов)
+@router.message(Command("create_recurring"))
+async def cmd_create_recurring(message: Message, command: CommandObject, db: Database, admin_ids: List[int]):
+    user_id = message.from_user.id
+    logger.info(f"🔁 Админ {user_id} создает серию задач: {command.args}")
+    
+    if not is_admin(user_id, admin_ids):
+        await message.answer("❌ У вас нет прав для выполнения этой команды")
+        return
+    
+    usage_text = (
+        "🔁 Формат команды:\n"
+        "/create_recurring @username ПРАВИЛО HH:MM Описание задачи\n\n"
+        "Правила:\n"
+        "daily - каждый день\n"
+        "mon, tue, wed, thu, fri, sat, sun - каждую неделю в этот день\n"
+        "month:N - N-го числа каждого месяца\n\n"
+        "📌 Пример:\n"
+        "/create_recurring @user1 mon 09:00 Еженедельный отчет"
+    )
+    
+    if not command.args:
+        await message.answer(usage_text)
+        return
+    
+    try:
+        args = command.args.split()
+        if len(args) < 4:
+            raise ValueError("Недостаточно аргументов")
+        
+        username = args[0]
+        rule_kind, rule_value = parse_rule(args[1])
+        time_str = datetime.strptime(args[2], "%H:%M").strftime("%H:%M")
+        description = " ".join(args[3:])
+        
+        series_id, first_deadline = db.create_recurring_task(description, username, rule_kind, rule_value, time_str)
+        rule_text = describe_rule(rule_kind, rule_value, time_str)
+        
+        await message.answer(
+            f"✅ Повторяющаяся задача создана!\n\n"
+            f"ID серии: {series_id}\n"
+            f"Описание: {description}\n"
+            f"Исполнитель: {username}\n"
+            f"Повтор: {rule_text}\n"
+            f"Ближайший дедлайн: {first_deadline.strftime('%d.%m.%Y %H:%M')}"
+        )
+        logger.info(f"✅ Серия #{series_id} создана для {username}")
+        
+        # УВЕДОМЛЕНИЕ ИСПОЛНИТЕЛЮ
+        await notify_assignee(
+            message, db, username,
+            f"🔁 Вам назначена повторяющаяся задача!\n\n"
+            f"🆔 ID серии: {series_id}\n"
+            f"📝 Описание: {description}\n"
+            f"🔁 Повтор: {rule_text}\n"
+            f"⏰ Ближайший дедлайн: {first_deadline.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"Для просмотра задач используйте команду /tasks"
+        )
+        
+    except ValueError as e:
+        await message.answer(f"❌ Ошибка формата: {e}\n\n{usage_text}")
+
 # Команда /all_tasks (только для администраторов)
-@dp.message(Command("all_tasks"))
-async def cmd_all_tasks(message: Message):
-    if not is_admin(message.from_user.id):
+@router.message(Command("all_tasks"))
+async def cmd_all_tasks(message: Message, db: Database, admin_ids: List[int]):
+    if not is_admin(message.from_user.id, admin_ids):
         await message.answer("❌ У вас нет прав для выполнения этой команды")
         return
     
@@ -296,9 +393,9 @@ async def cmd_all_tasks(message: Message):
     await message.answer(text)
 
 # Команда /delete_task (только для администраторов)
-@dp.message(Command("delete_task"))
-async def cmd_delete_task(message: Message, command: CommandObject):
-    if not is_admin(message.from_user.id):
+@router.message(Command("delete_task"))
+async def cmd_delete_task(message: Message, command: CommandObject, db: Database, admin_ids: List[int]):
+    if not is_admin(message.from_user.id, admin_ids):
         await message.answer("❌ У вас нет прав для выполнения этой команды")
         return
     
@@ -323,9 +420,9 @@ async def cmd_delete_task(message: Message, command: CommandObject):
         await message.answer(f"❌ Ошибка при удалении задачи: {e}")
 
 # Команда /users (только для администраторов)
-@dp.message(Command("users"))
-async def cmd_users(message: Message):
-    if not is_admin(message.from_user.id):
+@router.message(Command("users"))
+async def cmd_users(message: Message, db: Database, admin_ids: List[int]):
+    if not is_admin(message.from_user.id, admin_ids):
         await message.answer("❌ У вас нет прав для выполнения этой команды")
         return
     
@@ -346,9 +443,52 @@ async def cmd_users(message: Message):
     
     await message.answer(text)
 
-# Функция для отправки уведомлений
-async def send_notifications():
-    while True:
+async def wait_for_shutdown(seconds: float) -> bool:
+    """Спит заданное время, но просыпается сразу при остановке бота"""
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+# Уведомления одной команды
+async def notify_tenant(tenant: Dict, now: datetime):
+    tasks_for_notification = tenant['db'].get_tasks_for_notification()
+    logger.info(f"📨 [{tenant['name']}] Найдено задач для уведомления: {len(tasks_for_notification)}")
+    
+    for task in tasks_for_notification:
+        task_id, description, assignee_username, deadline, user_id = task
+        deadline_dt = datetime.fromisoformat(deadline)
+        days_left = (deadline_dt.date() - now.date()).days
+        
+        if user_id:
+            try:
+                if days_left == 7:
+                    message_text = (
+                        f"🔔 Напоминание о задаче!\n\n"
+                        f"Задача #{task_id}: {description}\n"
+                        f"Дедлайн: {deadline_dt.strftime('%d.%m.%Y %H:%M')}\n"
+                        f"⏰ До дедлайна осталось 7 дней"
+                    )
+                elif days_left == 1:
+                    message_text = (
+                        f"🔔 Срочное напоминание!\n\n"
+                        f"Задача #{task_id}: {description}\n"
+                        f"Дедлайн: {deadline_dt.strftime('%d.%m.%Y %H:%M')}\n"
+                        f"⏰ До дедлайна остался 1 день!"
+                    )
+                else:
+                    continue
+                
+                await tenant['bot'].send_message(user_id, message_text)
+                logger.info(f"✅ [{tenant['name']}] Отправлено уведомление пользователю {assignee_username} о задаче #{task_id}")
+                
+            except Exception as e:
+                logger.error(f"❌ [{tenant['name']}] Не удалось отправить уведомление пользователю {user_id}: {e}")
+
+# Функция для отправки уведомлений: один цикл на все команды процесса
+async def send_notifications(tenants: Dict[int, Dict]):
+    while not shutdown_event.is_set():
         try:
             now = datetime.now(moscow_tz)
             logger.info(f"🔔 Проверка уведомлений в {now.strftime('%d.%m.%Y %H:%M:%S')}")
@@ -356,63 +496,101 @@ async def send_notifications():
             # Проверяем, что сейчас 9:00 по Москве
             if now.hour == 9 and now.minute == 0:
                 logger.info("⏰ Время отправки уведомлений - 9:00")
-                tasks_for_notification = db.get_tasks_for_notification()
-                logger.info(f"📨 Найдено задач для уведомления: {len(tasks_for_notification)}")
-                
-                for task in tasks_for_notification:
-                    task_id, description, assignee_username, deadline, user_id = task
-                    deadline_dt = datetime.fromisoformat(deadline)
-                    days_left = (deadline_dt.date() - now.date()).days
-                    
-                    if user_id:
-                        try:
-                            if days_left == 7:
-                                message_text = (
-                                    f"🔔 Напоминание о задаче!\n\n"
-                                    f"Задача #{task_id}: {description}\n"
-                                    f"Дедлайн: {deadline_dt.strftime('%d.%m.%Y %H:%M')}\n"
-                                    f"⏰ До дедлайна осталось 7 дней"
-                                )
-                            elif days_left == 1:
-                                message_text = (
-                                    f"🔔 Срочное напоминание!\n\n"
-                                    f"Задача #{task_id}: {description}\n"
-                                    f"Дедлайн: {deadline_dt.strftime('%d.%m.%Y %H:%M')}\n"
-                                    f"⏰ До дедлайна остался 1 день!"
-                                )
-                            else:
-                                continue
-                            
-                            await bot.send_message(user_id, message_text)
-                            logger.info(f"✅ Отправлено уведомление пользователю {assignee_username} о задаче #{task_id}")
-                            
-                        except Exception as e:
-                            logger.error(f"❌ Не удалось отправить уведомление пользователю {user_id}: {e}")
+                for tenant in tenants.values():
+                    try:
+                        await notify_tenant(tenant, now)
+                    except Exception as e:
+                        logger.error(f"❌ [{tenant['name']}] Ошибка при отправке уведомлений: {e}")
                 
                 # Ждем 1 минуту, чтобы не отправлять уведомления несколько раз
-                await asyncio.sleep(60)
+                if await wait_for_shutdown(60):
+                    break
             
             # Проверяем каждую минуту
-            await asyncio.sleep(60)
+            await wait_for_shutdown(60)
             
         except Exception as e:
             logger.error(f"❌ Ошибка в функции отправки уведомлений: {e}")
-            await asyncio.sleep(60)
+            await wait_for_shutdown(60)
+    
+    logger.info("🔕 Рассылка уведомлений остановлена")
+
+@router.startup()
+async def on_startup(tenants: Dict[int, Dict]):
+    logger.info(f"⏱ Холодный старт: {time.perf_counter() - START_TIME:.2f} с (ботов: {len(tenants)})")
+
+@router.shutdown()
+async def on_shutdown(bots: List[Bot], in_flight: InFlightMiddleware, notification_task: asyncio.Task):
+    # Polling уже остановлен: новые обновления не принимаются
+    logger.info(f"🛑 Остановка: ожидаю завершения обработчиков ({in_flight.in_flight} в работе)")
+    shutdown_event.set()
+    
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(in_flight.idle.wait(), notification_task),
+            timeout=SHUTDOWN_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ Не все обработчики завершились за {SHUTDOWN_TIMEOUT} с")
+    
+    # Обновления последней полученной пачки могут быть еще не подтверждены:
+    # подтверждаем только полностью обработанные, остальные достанутся следующему экземпляру
+    for bot in bots:
+        offset = in_flight.confirmed_offset(bot.id)
+        if offset is None:
+            continue
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.error(f"❌ Не удалось подтвердить обновления бота {bot.id}: {e}")
+    
+    logger.info("👋 Бот остановлен")
+
+def create_dispatcher(tenants: Dict[int, Dict]) -> Dispatcher:
+    """Собирает общий диспетчер для всех ботов процесса"""
+    storage = SQLiteStorage({bot_id: tenant['db'] for bot_id, tenant in tenants.items()})
+    dp = Dispatcher(storage=storage, tenants=tenants)
+    
+    in_flight = InFlightMiddleware()
+    dp.update.outer_middleware(in_flight)
+    sessions = {id(tenant['bot'].session): tenant['bot'].session for tenant in tenants.values()}
+    for session in sessions.values():
+        session.middleware(in_flight.track_get_updates)
+    dp.update.outer_middleware(TenantMiddleware(tenants))
+    dp["in_flight"] = in_flight
+    
+    dp.include_router(router)
+    return dp
 
 async def main():
     try:
         logger.info("🚀 ЗАПУСК БОТА УПРАВЛЕНИЯ ЗАДАЧАМИ...")
-        logger.info(f"👑 Администраторы: {ADMIN_IDS}")
+        
+        # Все боты используют одну HTTP-сессию, один диспетчер и один цикл уведомлений
+        session = AiohttpSession()
+        tenants = {}
+        for tenant in load_tenants():
+            bot = Bot(token=tenant['token'], session=session)
+            if bot.id in tenants:
+                raise ValueError(f"Токен команды {tenant['name']} уже используется")
+            tenant['bot'] = bot
+            tenant['db'] = Database(tenant['database'])
+            tenants[bot.id] = tenant
+            logger.info(f"👑 [{tenant['name']}] Администраторы: {tenant['admin_ids']}, база: {tenant['database']}")
+        
+        dp = create_dispatcher(tenants)
         
         # Запускаем задачу для отправки уведомлений
-        asyncio.create_task(send_notifications())
+        dp["notification_task"] = asyncio.create_task(send_notifications(tenants))
         
-        # Удаляем вебхук и запускаем polling
-        await bot.delete_webhook(drop_pending_updates=True)
+        # Удаляем вебхуки, сохраняя накопившиеся за время перезапуска обновления
+        bots = [tenant['bot'] for tenant in tenants.values()]
+        for bot in bots:
+            await bot.delete_webhook(drop_pending_updates=False)
         logger.info("✅ Бот запущен и готов к работе!")
         
-        # Запускаем polling
-        await dp.start_polling(bot)
+        # Запускаем polling; SIGTERM/SIGINT останавливают его и вызывают on_shutdown
+        await dp.start_polling(*bots)
         
     except Exception as e:
         logger.error(f"❌ Критическая ошибка при запуске бота: {e}")
@@ -420,4 +598,4 @@ async def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,45 @@ ADMIN_IDS = [int(x.strip()) for x in os.getenv('ADMIN_IDS', '451294137').split('
 # Настройки базы данных
 DATABASE_NAME = 'tasks.db'
 
+# Несколько ботов (команд) в одном процессе. Файл со списком:
+# [{"name": "team1", "token": "...", "admin_ids": [1, 2], "database": "team1.db"}, ...]
+# Если файла нет, запускается один бот из BOT_TOKEN, ADMIN_IDS и DATABASE_NAME
+TENANTS_FILE = os.getenv('TENANTS_FILE', 'tenants.json')
+
 # Настройки времени
 MOSCOW_TZ = 'Europe/Moscow'
-NOTIFICATION_TIME = '09:00'  # Время отправки уведомлений
\ No newline at end of file
+NOTIFICATION_TIME = '09:00'  # Время отправки уведомлений
+
+# Сколько секунд ждать завершения обработчиков при остановке (SIGTERM)
+SHUTDOWN_TIMEOUT = int(os.getenv('SHUTDOWN_TIMEOUT', '30'))
+
+def load_tenants() -> list:
+    """Загружает список команд: name, token, admin_ids, database"""
+    if not os.path.exists(TENANTS_FILE):
+        return [{
+            'name': 'default',
+            'token': BOT_TOKEN,
+            'admin_ids': ADMIN_IDS,
+            'database': DATABASE_NAME
+        }]
+    
+    with open(TENANTS_FILE, encoding='utf-8') as f:
+        tenants = json.load(f)
+    
+    if not tenants:
+        raise ValueError(f"В {TENANTS_FILE} не указано ни одной команды")
+    
+    databases = {}
+    for tenant in tenants:
+        if not tenant.get('name') or not tenant.get('token'):
+            raise ValueError(f"В {TENANTS_FILE} у каждой команды должны быть name и token")
+        tenant['admin_ids'] = [int(x) for x in tenant.get('admin_ids', [])]
+        tenant.setdefault('database', f"{tenant['name']}.db")
+        
+        # Общая база смешала бы задачи, пользователей и состояния разных команд
+        path = os.path.abspath(tenant['database'])
+        if path in databases:
+            raise ValueError(f"Команды {databases[path]} и {tenant['name']} используют одну базу {tenant['database']}")
+        databases[path] = tenant['name']
+    
+    return tenants
@@ -1,23 +1,38 @@
 import sqlite3
+import json
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import pytz
 from config import DATABASE_NAME, MOSCOW_TZ
+from recurrence import next_occurrence
 
 logger = logging.getLogger(__name__)
 
+# Увеличивайте при каждом изменении структуры таблиц в init_database
+SCHEMA_VERSION = 2
+
 class Database:
     def __init__(self, db_name: str = DATABASE_NAME):
         self.db_name = db_name
         self.moscow_tz = pytz.timezone(MOSCOW_TZ)
-        self.init_database()
+        self._schema_checked = False
 
     def get_connection(self):
-        return sqlite3.connect(self.db_name, check_same_thread=False)
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        if not self._schema_checked:
+            # Схема проверяется один раз при первом обращении, а не при импорте
+            self.ensure_schema(conn)
+        return conn
 
-    def init_database(self):
-        conn = self.get_connection()
+    def ensure_schema(self, conn):
+        """Выполняет DDL, только если версия схемы в файле устарела"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self.init_database(conn)
+        self._schema_checked = True
+
+    def init_database(self, conn):
         cursor = conn.cursor()
         
         # Таблица пользователей
@@ -43,13 +58,52 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 completed_at TIMESTAMP,
                 comment TEXT,
-                FOREIGN KEY (assignee_id) REFERENCES users (user_id)
+                series_id INTEGER,
+                FOREIGN KEY (assignee_id) REFERENCES users (user_id),
+                FOREIGN KEY (series_id) REFERENCES recurring_tasks (id)
+            )
+        ''')
+        
+        # Старые базы создавались без колонки series_id
+        cursor.execute('PRAGMA table_info(tasks)')
+        if 'series_id' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN series_id INTEGER REFERENCES recurring_tasks (id)')
+        
+        # Таблица повторяющихся задач: одна строка на серию.
+        # current_task_id указывает на ближайшее невыполненное вхождение,
+        # NULL означает, что его нужно создать при следующем чтении.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recurring_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                description TEXT NOT NULL,
+                assignee_username TEXT NOT NULL,
+                rule_kind TEXT NOT NULL,
+                rule_value INTEGER NOT NULL,
+                rule_time TEXT NOT NULL,
+                next_deadline TIMESTAMP NOT NULL,
+                current_task_id INTEGER,
+                active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_recurring_pending
+            ON recurring_tasks (active, current_task_id)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_series ON tasks (series_id)')
         
+        # Состояния FSM переживают перезапуск бота
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT
+            )
+        ''')
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
-        conn.close()
-        logger.info("✅ База данных инициализирована")
+        logger.info(f"✅ База данных инициализирована (версия схемы {SCHEMA_VERSION})")
 
     def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
         conn = self.get_connection()
@@ -62,31 +116,80 @@ class Database:
         conn.close()
         logger.info(f"✅ Пользователь {user_id} добавлен в базу")
 
-    def create_task(self, description: str, assignee_username: str, deadline: datetime):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+    def _insert_task(self, cursor, description: str, assignee_username: str, deadline, series_id: int = None):
         # Находим ID пользователя по username
         cursor.execute('SELECT user_id FROM users WHERE username = ?', (assignee_username.lstrip('@'),))
         result = cursor.fetchone()
         assignee_id = result[0] if result else None
         
         cursor.execute('''
-            INSERT INTO tasks (description, assignee_username, assignee_id, deadline, status)
-            VALUES (?, ?, ?, ?, 'todo')
-        ''', (description, assignee_username, assignee_id, deadline))
+            INSERT INTO tasks (description, assignee_username, assignee_id, deadline, status, series_id)
+            VALUES (?, ?, ?, ?, 'todo', ?)
+        ''', (description, assignee_username, assignee_id, deadline, series_id))
+        return cursor.lastrowid
+
+    def create_task(self, description: str, assignee_username: str, deadline: datetime):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        task_id = self._insert_task(cursor, description, assignee_username, deadline)
         
-        task_id = cursor.lastrowid
         conn.commit()
         conn.close()
         logger.info(f"✅ Задача #{task_id} создана для {assignee_username}")
         return task_id
 
+    def create_recurring_task(self, description: str, assignee_username: str,
+                              rule_kind: str, rule_value: int, rule_time: str):
+        """Создает серию задач. Вхождения создаются по одному, когда они нужны"""
+        first_deadline = next_occurrence(rule_kind, rule_value, rule_time, datetime.now(self.moscow_tz))
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO recurring_tasks (description, assignee_username, rule_kind, rule_value, rule_time, next_deadline)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (description, assignee_username, rule_kind, rule_value, rule_time, first_deadline))
+        
+        series_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        logger.info(f"✅ Серия #{series_id} создана для {assignee_username}")
+        return series_id, first_deadline
+
+    def materialize_recurring_tasks(self, cursor=None, series_id: int = None):
+        """Создает очередное вхождение для серий, у которых его еще нет"""
+        conn = None
+        if cursor is None:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+        
+        query = '''
+            SELECT id, description, assignee_username, next_deadline
+            FROM recurring_tasks
+            WHERE active = 1 AND current_task_id IS NULL
+        '''
+        if series_id is not None:
+            cursor.execute(query + ' AND id = ?', (series_id,))
+        else:
+            cursor.execute(query)
+        
+        for row_id, description, assignee_username, next_deadline in cursor.fetchall():
+            task_id = self._insert_task(cursor, description, assignee_username, next_deadline, row_id)
+            cursor.execute('UPDATE recurring_tasks SET current_task_id = ? WHERE id = ?', (task_id, row_id))
+            logger.info(f"🔁 Серия #{row_id}: создана задача #{task_id} на {next_deadline}")
+        
+        if conn:
+            conn.commit()
+            conn.close()
+
     def get_user_tasks(self, user_id: int) -> List[Dict]:
         conn = self.get_connection()
         cursor = conn.cursor()
+        self.materialize_recurring_tasks(cursor)
+        conn.commit()
         cursor.execute('''
-            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment
+            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment, series_id
             FROM tasks 
             WHERE assignee_id = ? OR assignee_username = (SELECT username FROM users WHERE user_id = ?)
             ORDER BY deadline ASC
@@ -106,7 +209,8 @@ class Database:
                 'status': row[4],
                 'created_at': created_at,
                 'completed_at': completed_at,
-                'comment': row[7]
+                'comment': row[7],
+                'series_id': row[8]
             })
         
         conn.close()
@@ -115,8 +219,10 @@ class Database:
     def get_all_tasks(self) -> List[Dict]:
         conn = self.get_connection()
         cursor = conn.cursor()
+        self.materialize_recurring_tasks(cursor)
+        conn.commit()
         cursor.execute('''
-            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment
+            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment, series_id
             FROM tasks 
             ORDER BY deadline ASC
         ''')
@@ -135,7 +241,8 @@ class Database:
                 'status': row[4],
                 'created_at': created_at,
                 'completed_at': completed_at,
-                'comment': row[7]
+                'comment': row[7],
+                'series_id': row[8]
             })
         
         conn.close()
@@ -149,6 +256,30 @@ class Database:
             SET status = 'done', completed_at = CURRENT_TIMESTAMP, comment = ?
             WHERE id = ?
         ''', (comment, task_id))
+        
+        cursor.execute('''
+            SELECT r.id, r.rule_kind, r.rule_value, r.rule_time, t.deadline
+            FROM recurring_tasks r
+            JOIN tasks t ON t.id = r.current_task_id
+            WHERE r.current_task_id = ? AND r.active = 1
+        ''', (task_id,))
+        series = cursor.fetchone()
+        
+        if series:
+            series_id, rule_kind, rule_value, rule_time, deadline = series
+            # Следующее вхождение не раньше текущего момента, пропущенные не копятся
+            after = max(datetime.fromisoformat(deadline), datetime.now(self.moscow_tz))
+            next_deadline = next_occurrence(rule_kind, rule_value, rule_time, after)
+            cursor.execute('''
+                UPDATE recurring_tasks SET current_task_id = NULL, next_deadline = ?
+                WHERE id = ?
+            ''', (next_deadline, series_id))
+            # Храним только последнее выполненное вхождение серии
+            cursor.execute('''
+                DELETE FROM tasks WHERE series_id = ? AND status = 'done' AND id != ?
+            ''', (series_id, task_id))
+            self.materialize_recurring_tasks(cursor, series_id)
+        
         conn.commit()
         conn.close()
         logger.info(f"✅ Задача #{task_id} выполнена")
@@ -156,6 +287,15 @@ class Database:
     def delete_task(self, task_id: int):
         conn = self.get_connection()
         cursor = conn.cursor()
+        
+        # Удаление текущего (невыполненного) вхождения серии останавливает всю серию.
+        # Удаление уже выполненного вхождения серию не затрагивает
+        cursor.execute('SELECT id FROM recurring_tasks WHERE current_task_id = ?', (task_id,))
+        result = cursor.fetchone()
+        if result:
+            cursor.execute('UPDATE recurring_tasks SET active = 0, current_task_id = NULL WHERE id = ?', (result[0],))
+            logger.info(f"🛑 Серия #{result[0]} остановлена")
+        
         cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
         conn.commit()
         conn.close()
@@ -172,6 +312,8 @@ class Database:
     def get_tasks_for_notification(self):
         conn = self.get_connection()
         cursor = conn.cursor()
+        self.materialize_recurring_tasks(cursor)
+        conn.commit()
         
         now = datetime.now(self.moscow_tz)
         seven_days = now + timedelta(days=7)
@@ -213,7 +355,7 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment
+            SELECT id, description, assignee_username, deadline, status, created_at, completed_at, comment, series_id
             FROM tasks WHERE id = ?
         ''', (task_id,))
         
@@ -235,8 +377,44 @@ class Database:
             'status': row[4],
             'created_at': created_at,
             'completed_at': completed_at,
-            'comment': row[7]
+            'comment': row[7],
+            'series_id': row[8]
         }
 
-# Создаем глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+    def get_fsm_state(self, key: str) -> Optional[str]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT state FROM fsm_states WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def set_fsm_state(self, key: str, state: Optional[str]):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO fsm_states (key, state) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state
+        ''', (key, state))
+        cursor.execute('DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data IS NULL', (key,))
+        conn.commit()
+        conn.close()
+
+    def get_fsm_data(self, key: str) -> Dict:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT data FROM fsm_states WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        conn.close()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def set_fsm_data(self, key: str, data: Dict):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO fsm_states (key, data) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET data = excluded.data
+        ''', (key, json.dumps(data) if data else None))
+        cursor.execute('DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data IS NULL', (key,))
+        conn.commit()
+        conn.close()
\ No newline at end of file
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import Update
+
+
+# Отслеживание обновлений для плавной остановки: обновление считается
+# «в работе» с момента получения через getUpdates и до завершения обработчика
+class InFlightMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.pending: Dict[int, Set[int]] = {}
+        self.last_handled_ids: Dict[int, int] = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(len(ids) for ids in self.pending.values())
+
+    async def track_get_updates(
+        self,
+        make_request: Callable[[Bot, TelegramMethod], Awaitable[Any]],
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        """Middleware HTTP-сессии: запоминает обновления сразу после получения,
+        еще до того, как диспетчер запустит для них обработчики"""
+        result = await make_request(bot, method)
+        if isinstance(method, GetUpdates) and result:
+            self.pending.setdefault(bot.id, set()).update(update.update_id for update in result)
+            self.idle.clear()
+        return result
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            bot_id = data['bot'].id
+            self.pending.get(bot_id, set()).discard(event.update_id)
+            if event.update_id > self.last_handled_ids.get(bot_id, -1):
+                self.last_handled_ids[bot_id] = event.update_id
+            if self.in_flight == 0:
+                self.idle.set()
+
+    def confirmed_offset(self, bot_id: int) -> Optional[int]:
+        """Offset, ниже которого все обновления бота полностью обработаны"""
+        pending = self.pending.get(bot_id)
+        if pending:
+            return min(pending)
+        last_handled_id = self.last_handled_ids.get(bot_id)
+        return last_handled_id + 1 if last_handled_id is not None else None
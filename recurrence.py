@@ -0,0 +1,71 @@
+import calendar
+from datetime import datetime, timedelta
+from typing import Tuple
+
+import pytz
+from config import MOSCOW_TZ
+
+moscow_tz = pytz.timezone(MOSCOW_TZ)
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+WEEKDAY_NAMES = [
+    'каждый понедельник', 'каждый вторник', 'каждую среду', 'каждый четверг',
+    'каждую пятницу', 'каждую субботу', 'каждое воскресенье'
+]
+
+
+def parse_rule(rule: str) -> Tuple[str, int]:
+    """Разбирает правило повтора: daily, mon..sun или month:N"""
+    rule = rule.strip().lower()
+
+    if rule == 'daily':
+        return 'daily', 0
+    if rule in WEEKDAYS:
+        return 'weekly', WEEKDAYS.index(rule)
+    if rule.startswith('month:'):
+        try:
+            day = int(rule.split(':', 1)[1])
+        except ValueError:
+            day = 0
+        if not 1 <= day <= 31:
+            raise ValueError("День месяца должен быть от 1 до 31")
+        return 'monthly', day
+
+    raise ValueError(f"Неизвестное правило повтора: {rule}")
+
+
+def describe_rule(kind: str, value: int, time_str: str) -> str:
+    """Возвращает правило повтора в читаемом виде"""
+    if kind == 'daily':
+        return f"каждый день в {time_str}"
+    if kind == 'weekly':
+        return f"{WEEKDAY_NAMES[value]} в {time_str}"
+    return f"{value}-го числа каждого месяца в {time_str}"
+
+
+def _monthly_date(year: int, month: int, day: int) -> datetime:
+    # Для коротких месяцев берем последний день (например, 31 -> 30 или 28)
+    last_day = calendar.monthrange(year, month)[1]
+    return datetime(year, month, min(day, last_day))
+
+
+def next_occurrence(kind: str, value: int, time_str: str, after: datetime) -> datetime:
+    """Находит ближайший дедлайн серии строго после момента after"""
+    after = after.astimezone(moscow_tz)
+    hour, minute = (int(x) for x in time_str.split(':'))
+    day = datetime(after.year, after.month, after.day)
+
+    if kind == 'monthly':
+        candidate = _monthly_date(day.year, day.month, value)
+        while moscow_tz.localize(candidate.replace(hour=hour, minute=minute)) <= after:
+            year, month = (candidate.year + 1, 1) if candidate.month == 12 else (candidate.year, candidate.month + 1)
+            candidate = _monthly_date(year, month, value)
+        return moscow_tz.localize(candidate.replace(hour=hour, minute=minute))
+
+    step = timedelta(days=1 if kind == 'daily' else 7)
+    candidate = day
+    if kind == 'weekly':
+        candidate += timedelta(days=(value - day.weekday()) % 7)
+    while moscow_tz.localize(candidate.replace(hour=hour, minute=minute)) <= after:
+        candidate += step
+    return moscow_tz.localize(candidate.replace(hour=hour, minute=minute))
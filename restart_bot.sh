@@ -1,6 +1,20 @@
 #!/bin/bash
-echo "🛑 Останавливаю все процессы бота..."
-pkill -f "python bot.py"
-sleep 3
+echo "🛑 Останавливаю бота (SIGTERM)..."
+pkill -TERM -f "python bot.py"
+
+# Бот дорабатывает текущие обновления и сам завершается за SHUTDOWN_TIMEOUT секунд
+# (по умолчанию 30); ждем чуть дольше, чтобы не прервать его
+SHUTDOWN_TIMEOUT=${SHUTDOWN_TIMEOUT:-$(grep -s '^SHUTDOWN_TIMEOUT=' .env | cut -d= -f2 | tr -d "\"' ")}
+WAIT_SECONDS=$(( ${SHUTDOWN_TIMEOUT:-30} + 10 ))
+for i in $(seq 1 "$WAIT_SECONDS"); do
+    pgrep -f "python bot.py" > /dev/null || break
+    sleep 1
+done
+
+if pgrep -f "python bot.py" > /dev/null; then
+    echo "⚠️ Бот не завершился вовремя, принудительная остановка"
+    pkill -KILL -f "python bot.py"
+fi
+
 echo "🚀 Запускаю бота..."
-python bot.py
\ No newline at end of file
+python bot.py
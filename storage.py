@@ -0,0 +1,38 @@
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database import Database
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в базе бота, чтобы состояния не терялись при перезапуске.
+
+    Каждый бот хранит состояния в базе своей команды (databases: bot_id -> Database)
+    """
+
+    def __init__(self, databases: Dict[int, Database]):
+        self.databases = databases
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ':'.join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            key.business_connection_id, key.destiny
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self.databases[key.bot_id].set_fsm_state(self._key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self.databases[key.bot_id].get_fsm_state(self._key(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self.databases[key.bot_id].set_fsm_data(self._key(key), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self.databases[key.bot_id].get_fsm_data(self._key(key))
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def tenants_file(tmp_path, monkeypatch):
+    path = tmp_path / 'tenants.json'
+    monkeypatch.setattr(config, 'TENANTS_FILE', str(path))
+    monkeypatch.chdir(tmp_path)
+
+    def write(tenants):
+        path.write_text(json.dumps(tenants), encoding='utf-8')
+    return write
+
+
+def test_default_tenant_without_file(tenants_file):
+    tenants = config.load_tenants()
+    assert len(tenants) == 1
+    assert tenants[0]['database'] == config.DATABASE_NAME
+
+
+def test_tenant_defaults(tenants_file):
+    tenants_file([{'name': 'team1', 'token': '1:x', 'admin_ids': ['10']}])
+    assert config.load_tenants() == [
+        {'name': 'team1', 'token': '1:x', 'admin_ids': [10], 'database': 'team1.db'}
+    ]
+
+
+def test_empty_tenant_list(tenants_file):
+    tenants_file([])
+    with pytest.raises(ValueError):
+        config.load_tenants()
+
+
+@pytest.mark.parametrize('second', [
+    {'name': 'team2', 'token': '2:y', 'database': './team1.db'},
+    {'name': 'team1', 'token': '2:y'},
+])
+def test_shared_database_rejected(tenants_file, second):
+    tenants_file([{'name': 'team1', 'token': '1:x'}, second])
+    with pytest.raises(ValueError):
+        config.load_tenants()
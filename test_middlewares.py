@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.methods import GetMe, GetUpdates
+from aiogram.types import Update
+
+from middlewares import InFlightMiddleware
+
+BOT = Bot(token='111:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+OTHER_BOT = Bot(token='222:BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB')
+
+
+def update(update_id):
+    return Update(update_id=update_id)
+
+
+def fetch(middleware, bot, update_ids, offset=None):
+    """Имитирует ответ getUpdates, прошедший через middleware сессии"""
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method)
+        return [update(update_id) for update_id in update_ids]
+
+    method = GetUpdates(offset=offset)
+    result = asyncio.run(middleware.track_get_updates(make_request, bot, method))
+    return sent[0], result
+
+
+def handle(middleware, bot, update_id, fail=False):
+    async def handler(event, data):
+        if fail:
+            raise RuntimeError('ошибка обработчика')
+
+    return asyncio.run(middleware(handler, update(update_id), {'bot': bot}))
+
+
+def test_get_updates_passes_through_unchanged():
+    middleware = InFlightMiddleware()
+    fetch(middleware, BOT, [1, 2, 3])
+
+    method, result = fetch(middleware, BOT, [4], offset=4)
+    assert method.offset == 4
+    assert [u.update_id for u in result] == [4]
+
+
+def test_other_methods_are_not_tracked():
+    middleware = InFlightMiddleware()
+
+    async def make_request(bot, method):
+        return None
+
+    asyncio.run(middleware.track_get_updates(make_request, BOT, GetMe()))
+    assert middleware.in_flight == 0
+    assert middleware.idle.is_set()
+
+
+def test_update_is_pending_from_fetch_until_handled():
+    middleware = InFlightMiddleware()
+    fetch(middleware, BOT, [10, 11])
+    assert middleware.in_flight == 2
+    assert not middleware.idle.is_set()
+    assert middleware.confirmed_offset(BOT.id) == 10
+
+    handle(middleware, BOT, 11)
+    assert middleware.confirmed_offset(BOT.id) == 10
+
+    handle(middleware, BOT, 10)
+    assert middleware.idle.is_set()
+    assert middleware.confirmed_offset(BOT.id) == 12
+
+
+def test_failed_handler_counts_as_finished():
+    middleware = InFlightMiddleware()
+    fetch(middleware, BOT, [5])
+
+    with pytest.raises(RuntimeError):
+        handle(middleware, BOT, 5, fail=True)
+    assert middleware.idle.is_set()
+    assert middleware.confirmed_offset(BOT.id) == 6
+
+
+def test_confirmed_offset_is_per_bot():
+    middleware = InFlightMiddleware()
+    assert middleware.confirmed_offset(BOT.id) is None
+
+    fetch(middleware, BOT, [1])
+    fetch(middleware, OTHER_BOT, [7])
+    handle(middleware, OTHER_BOT, 7)
+
+    assert middleware.confirmed_offset(BOT.id) == 1
+    assert middleware.confirmed_offset(OTHER_BOT.id) == 8
+    assert not middleware.idle.is_set()
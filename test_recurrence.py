@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import Database
+from recurrence import moscow_tz, next_occurrence, parse_rule
+
+
+def msk(*args):
+    return moscow_tz.localize(datetime(*args))
+
+
+def test_parse_rule():
+    assert parse_rule('daily') == ('daily', 0)
+    assert parse_rule('MON') == ('weekly', 0)
+    assert parse_rule('sun') == ('weekly', 6)
+    assert parse_rule('month:31') == ('monthly', 31)
+
+
+@pytest.mark.parametrize('rule', ['month:0', 'month:32', 'month:x', 'month:', 'weekly'])
+def test_parse_rule_invalid(rule):
+    with pytest.raises(ValueError) as exc:
+        parse_rule(rule)
+    assert 'invalid literal' not in str(exc.value)
+
+
+def test_monthly_clamps_to_month_end():
+    assert next_occurrence('monthly', 31, '09:00', msk(2026, 1, 31, 10, 0)) == msk(2026, 2, 28, 9, 0)
+    assert next_occurrence('monthly', 31, '09:00', msk(2026, 3, 31, 10, 0)) == msk(2026, 4, 30, 9, 0)
+    assert next_occurrence('monthly', 31, '09:00', msk(2028, 2, 1, 0, 0)) == msk(2028, 2, 29, 9, 0)
+    assert next_occurrence('monthly', 15, '09:00', msk(2026, 12, 20, 0, 0)) == msk(2027, 1, 15, 9, 0)
+
+
+def test_weekly_steps_to_weekday():
+    # 19.10.2026 - понедельник
+    assert next_occurrence('weekly', 0, '09:00', msk(2026, 10, 19, 8, 0)) == msk(2026, 10, 19, 9, 0)
+    assert next_occurrence('weekly', 0, '09:00', msk(2026, 10, 19, 10, 0)) == msk(2026, 10, 26, 9, 0)
+    assert next_occurrence('weekly', 4, '18:30', msk(2026, 10, 19, 10, 0)) == msk(2026, 10, 23, 18, 30)
+
+
+def test_after_is_strict():
+    assert next_occurrence('daily', 0, '09:00', msk(2026, 10, 19, 9, 0)) == msk(2026, 10, 20, 9, 0)
+    assert next_occurrence('weekly', 0, '09:00', msk(2026, 10, 19, 9, 0)) == msk(2026, 10, 26, 9, 0)
+    assert next_occurrence('monthly', 19, '09:00', msk(2026, 10, 19, 9, 0)) == msk(2026, 11, 19, 9, 0)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'tasks.db'))
+    db.add_user(1, 'bob', 'Bob', '')
+    return db
+
+
+def todo_tasks(db):
+    return [task for task in db.get_all_tasks() if task['status'] == 'todo']
+
+
+def test_complete_creates_next_occurrence_and_prunes(db):
+    series_id, first_deadline = db.create_recurring_task('Отчет', '@bob', 'weekly', 0, '09:00')
+
+    tasks = db.get_user_tasks(1)
+    assert len(tasks) == 1
+    assert tasks[0]['series_id'] == series_id
+    assert tasks[0]['deadline'] == first_deadline
+
+    for i in range(3):
+        current = todo_tasks(db)[0]
+        db.complete_task(current['id'], 'готово')
+
+    tasks = db.get_all_tasks()
+    assert [task['status'] for task in tasks] == ['done', 'todo']
+    assert tasks[1]['deadline'] - tasks[0]['deadline'] == timedelta(days=7)
+    assert tasks[1]['deadline'] == first_deadline + timedelta(days=21)
+
+
+def test_complete_skips_missed_occurrences(db):
+    db.create_recurring_task('Отчет', '@bob', 'daily', 0, '09:00')
+    current = todo_tasks(db)[0]
+
+    conn = db.get_connection()
+    conn.execute('UPDATE tasks SET deadline = ? WHERE id = ?', (msk(2020, 1, 1, 9, 0), current['id']))
+    conn.commit()
+    conn.close()
+
+    db.complete_task(current['id'])
+    next_task = todo_tasks(db)[0]
+    now = datetime.now(moscow_tz)
+    assert now < next_task['deadline'] <= now + timedelta(days=1)
+
+
+def test_delete_done_occurrence_keeps_series(db):
+    db.create_recurring_task('Отчет', '@bob', 'daily', 0, '09:00')
+    done_id = todo_tasks(db)[0]['id']
+    db.complete_task(done_id)
+    pending_id = todo_tasks(db)[0]['id']
+
+    db.delete_task(done_id)
+    db.complete_task(pending_id)
+    assert len(todo_tasks(db)) == 1
+
+
+def test_delete_pending_occurrence_stops_series(db):
+    db.create_recurring_task('Отчет', '@bob', 'daily', 0, '09:00')
+    db.delete_task(todo_tasks(db)[0]['id'])
+    assert db.get_all_tasks() == []
@@ -0,0 +1,72 @@
+import asyncio
+import sqlite3
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from database import Database
+from storage import SQLiteStorage
+
+
+class States(StatesGroup):
+    waiting = State()
+
+
+@pytest.fixture
+def databases(tmp_path):
+    return {
+        111: Database(str(tmp_path / 'team1.db')),
+        222: Database(str(tmp_path / 'team2.db'))
+    }
+
+
+def key(bot_id=111, user_id=5):
+    return StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id)
+
+
+def test_state_and_data_round_trip(databases):
+    storage = SQLiteStorage(databases)
+
+    async def run():
+        await storage.set_state(key(), States.waiting)
+        await storage.update_data(key(), {'selected_task_id': 7})
+        return await storage.get_state(key()), await storage.get_data(key())
+
+    assert asyncio.run(run()) == ('States:waiting', {'selected_task_id': 7})
+
+
+def test_state_survives_new_storage(databases):
+    asyncio.run(SQLiteStorage(databases).set_state(key(), 'States:waiting'))
+    # Новый экземпляр бота после перезапуска читает то же состояние
+    restarted = {bot_id: Database(db.db_name) for bot_id, db in databases.items()}
+    assert asyncio.run(SQLiteStorage(restarted).get_state(key())) == 'States:waiting'
+
+
+def test_clearing_removes_row(databases):
+    storage = SQLiteStorage(databases)
+
+    async def run():
+        await storage.set_state(key(), States.waiting)
+        await storage.set_data(key(), {'selected_task_id': 7})
+        await storage.set_state(key(), None)
+        await storage.set_data(key(), {})
+        return await storage.get_state(key()), await storage.get_data(key())
+
+    assert asyncio.run(run()) == (None, {})
+    conn = sqlite3.connect(databases[111].db_name)
+    assert conn.execute('SELECT COUNT(*) FROM fsm_states').fetchone()[0] == 0
+    conn.close()
+
+
+def test_bots_use_their_own_database(databases):
+    storage = SQLiteStorage(databases)
+
+    async def run():
+        await storage.set_state(key(bot_id=111), States.waiting)
+        return await storage.get_state(key(bot_id=111)), await storage.get_state(key(bot_id=222))
+
+    assert asyncio.run(run()) == ('States:waiting', None)
+    conn = sqlite3.connect(databases[222].db_name)
+    assert conn.execute('SELECT COUNT(*) FROM fsm_states').fetchone()[0] == 0
+    conn.close()